@@ -0,0 +1,43 @@
+import argparse
+import functools
+import timeit
+
+from mydb import parser
+
+STATEMENTS = [
+    "SELECT * from XYZZY, ABC",
+    "select * from SYS.XYZZY",
+    "Select A from Sys.dual",
+    "Select A,B,C from Sys.dual",
+    "Select A, B, C from Sys.dual, Table2",
+    "Select A from Sys.dual where a in ('RED','GREEN','BLUE')",
+    "Select A from Sys.dual where a in ('RED','GREEN','BLUE') and b in (10,20,30)",
+    "Select A,b from table1,table2 where table1.id eq table2.id",
+    "select a from t where not (a > 1.5 or b is not null) and c != 'x'",
+    "Insert Into foo Values",
+]
+
+
+def _parse_all(strict: bool) -> None:
+    for text in STATEMENTS:
+        # bypass the statement cache, otherwise only the first round parses
+        parser.parse.__wrapped__(text, strict=strict)
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(
+        description="Time parsing the sample statements"
+    )
+    arg_parser.add_argument("-n", "--number", type=int, default=10_000)
+    args = arg_parser.parse_args()
+
+    for strict in (False, True):
+        seconds = timeit.timeit(
+            functools.partial(_parse_all, strict), number=args.number
+        )
+        per_statement = seconds / (args.number * len(STATEMENTS)) * 1e6
+        print(f"{strict=}: {seconds:.3f}s total, {per_statement:.2f}us per statement")
+
+
+if __name__ == "__main__":
+    main()
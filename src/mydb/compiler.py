@@ -0,0 +1,121 @@
+import functools
+from collections.abc import Callable, Iterator, Mapping
+from typing import Any
+
+import numpy
+
+from mydb import syntax
+
+type ColumnArrays = Mapping[str, numpy.ndarray[Any, Any]]
+type Predicate = Callable[[ColumnArrays, int], numpy.ndarray[Any, Any]]
+
+_OPERATORS: dict[syntax.ComparisonOperator, str] = {
+    "=": "==",
+    "!=": "!=",
+    "<": "<",
+    "<=": "<=",
+    ">": ">",
+    ">=": ">=",
+}
+
+
+def _column_source(name: str) -> str:
+    return f"columns[{name!r}]"
+
+
+# literal values are bound in the namespace of the compiled predicate rather
+# than written into its source, where their repr might not evaluate back to
+# them (e.g. float("inf") is written as inf)
+def _operand_source(operand: syntax.Operand, literals: list[syntax.Operand]) -> str:
+    if isinstance(operand, syntax.ColumnReference):
+        return _column_source(operand.name)
+    literals.append(operand)
+    return f"_v{len(literals) - 1}"
+
+
+def _source(expression: syntax.Expression, literals: list[syntax.Operand]) -> str:
+    match expression:
+        case syntax.Comparison(column=column, operator=operator, value=value):
+            return (
+                f"({_column_source(column)} {_OPERATORS[operator]} "
+                f"{_operand_source(value, literals)})"
+            )
+        case syntax.InValues(values=()):
+            # the parser rejects empty lists, but expressions can be built directly
+            return "numpy.zeros(length, dtype=bool)"
+        case syntax.InValues(column=column, values=values):
+            return "({})".format(
+                " | ".join(
+                    f"({_column_source(column)} == {_operand_source(value, literals)})"
+                    for value in values
+                )
+            )
+        case syntax.IsNull(negated=negated):
+            # tables cannot hold nulls yet
+            return f"numpy.full(length, {negated})"
+        case syntax.Not(operand=operand):
+            return f"(~{_source(operand, literals)})"
+        case syntax.And(operands=operands):
+            return "({})".format(
+                " & ".join(_source(operand, literals) for operand in operands)
+            )
+        case syntax.Or(operands=operands):
+            return "({})".format(
+                " | ".join(_source(operand, literals) for operand in operands)
+            )
+        case syntax.InSelect():
+            raise NotImplementedError("Subqueries are not implemented yet")
+
+
+def columns_in(expression: syntax.Expression) -> frozenset[str]:
+    match expression:
+        case syntax.Comparison(column=column, value=syntax.ColumnReference(name=name)):
+            return frozenset((column, name))
+        case syntax.InValues(column=column, values=values):
+            return frozenset(
+                [column]
+                + [
+                    value.name
+                    for value in values
+                    if isinstance(value, syntax.ColumnReference)
+                ]
+            )
+        case syntax.Comparison(column=column) | syntax.IsNull(column=column):
+            return frozenset((column,))
+        case syntax.InSelect(column=column):
+            return frozenset((column,))
+        case syntax.Not(operand=operand):
+            return columns_in(operand)
+        case syntax.And(operands=operands) | syntax.Or(operands=operands):
+            return frozenset().union(*map(columns_in, operands))
+
+
+def comparisons(expression: syntax.Expression) -> Iterator[tuple[str, syntax.Operand]]:
+    match expression:
+        case syntax.Comparison(column=column, value=value):
+            yield column, value
+        case syntax.InValues(column=column, values=values):
+            for value in values:
+                yield column, value
+        case syntax.Not(operand=operand):
+            yield from comparisons(operand)
+        case syntax.And(operands=operands) | syntax.Or(operands=operands):
+            for operand in operands:
+                yield from comparisons(operand)
+
+
+# WHERE expressions are compiled into a single numpy expression over whole
+# columns, instead of being interpreted once per row. Expressions are immutable,
+# so repeated queries reuse the compiled predicate
+@functools.lru_cache(maxsize=256)
+def compile_where(expression: syntax.Expression) -> Predicate:
+    literals: list[syntax.Operand] = []
+    source = (
+        "def predicate(columns, length):\n"
+        f"    return {_source(expression, literals)}\n"
+    )
+    namespace: dict[str, Any] = {"numpy": numpy}
+    namespace.update((f"_v{index}", value) for index, value in enumerate(literals))
+    exec(compile(source, "<where>", "exec"), namespace)
+    predicate: Predicate = namespace["predicate"]
+    return predicate
@@ -1,23 +1,33 @@
+import dataclasses
+import functools
+import re
+from collections.abc import Sequence
+from typing import Any, Literal, NamedTuple, cast
+
 import pyparsing
 from pyparsing import pyparsing_common as ppc
 
 from mydb import syntax
 
-pyparsing.ParserElement.enable_packrat()
+# packrat parsing is deliberately not enabled: the grammar barely backtracks, so
+# maintaining the memo table costs more than it saves (see benchmarks/bench_parser.py)
 
 # define SQL tokens
 
+KEYWORDS = "select from where and or in is not null insert into values".split()
 SELECT, FROM, WHERE, AND, OR, IN, IS, NOT, NULL, INSERT, INTO, VALUES = map(
-    pyparsing.CaselessKeyword,
-    "select from where and or in is not null insert into values".split(),
+    pyparsing.CaselessKeyword, KEYWORDS
 )
+# keywords are reserved, as in the hand-written lexer below, so column and table
+# names are checked against all of them with a single regex match
+ANY_KEYWORD = pyparsing.one_of(KEYWORDS, caseless=True, as_keyword=True)
 NOT_NULL = NOT + NULL
 
 IDENTIFIER = pyparsing.Word(
     pyparsing.alphas, pyparsing.alphanums + "_$"
 ).set_results_name("identifier")
 
-COLUMN_NAME = (
+COLUMN_NAME = ~ANY_KEYWORD + (
     pyparsing.DelimitedList(IDENTIFIER, ".", combine=True)
     .set_results_name("column name")
     .add_parse_action(ppc.upcase_tokens)
@@ -26,7 +36,7 @@ COLUMN_NAME = (
 COLUMN_NAME_LIST = pyparsing.Group(
     pyparsing.DelimitedList(COLUMN_NAME).set_results_name("column_list")
 )
-TABLE_NAME = (
+TABLE_NAME = ~ANY_KEYWORD + (
     pyparsing.DelimitedList(IDENTIFIER, ".", combine=True)
     .set_results_name("table name")
     .add_parse_action(ppc.upcase_tokens)
@@ -35,8 +45,10 @@ TABLE_NAME_LIST = pyparsing.Group(
     pyparsing.DelimitedList(TABLE_NAME).set_results_name("table_list")
 )
 
-BIN_OP = pyparsing.one_of(
-    "= != < > >= <= eq ne lt le gt ge", caseless=True
+# word operators are keywords, so that "a eqb" is not read as "a eq b"
+BIN_OP = (
+    pyparsing.one_of("= != < > >= <=")
+    | pyparsing.one_of("eq ne lt le gt ge", caseless=True, as_keyword=True)
 ).set_results_name("binop")
 REAL_NUM = ppc.real().set_results_name("real number")
 INT_NUM = ppc.signed_integer()
@@ -77,7 +89,7 @@ WHERE_EXPRESSION = pyparsing.infix_notation(
 # define the grammar
 SELECT_STMT <<= (
     SELECT
-    + ("*" | COLUMN_NAME_LIST)("columns")
+    + (pyparsing.Group(pyparsing.Literal("*"))("columns") | COLUMN_NAME_LIST("columns"))
     + FROM
     + TABLE_NAME_LIST("tables")
     + pyparsing.Opt(pyparsing.Group(WHERE + WHERE_EXPRESSION), "")("where")
@@ -94,14 +106,296 @@ ORACLE_SQL_COMMENT = "--" + pyparsing.rest_of_line
 SIMPLE_SQL.ignore(ORACLE_SQL_COMMENT)
 
 
-def parse(text: str) -> syntax.Statement:
-    results = SIMPLE_SQL.parse_string(text)
+_WORD_OPERATORS: dict[str, syntax.ComparisonOperator] = {
+    "EQ": "=",
+    "NE": "!=",
+    "LT": "<",
+    "LE": "<=",
+    "GT": ">",
+    "GE": ">=",
+}
+
+
+def _comparison_operator(text: str) -> syntax.ComparisonOperator:
+    return _WORD_OPERATORS.get(text.upper(), cast(syntax.ComparisonOperator, text))
+
+
+def _unquote(text: str) -> str:
+    quote = text[0]
+    return text[1:-1].replace(quote * 2, quote)
+
+
+def _operand_from_results(value: Any) -> syntax.Operand:
+    if isinstance(value, int | float):
+        return value
+    if value[0] in "'\"":
+        return _unquote(value)
+    return syntax.ColumnReference(name=value)
+
+
+def _where_from_results(results: Any) -> syntax.Expression:
+    if results[0] == "not":
+        return syntax.Not(operand=_where_from_results(results[1]))
+    if isinstance(results[1], str) and results[1] in ("and", "or"):
+        operands = tuple(_where_from_results(operand) for operand in results[::2])
+        if results[1] == "and":
+            return syntax.And(operands=operands)
+        return syntax.Or(operands=operands)
+    column, keyword = results[0], results[1]
+    if keyword == "in":
+        group = results[2]
+        if group[1] == "select":
+            return syntax.InSelect(column=column, select=_select_from_results(group))
+        return syntax.InValues(
+            column=column,
+            values=tuple(_operand_from_results(value) for value in group[1:-1]),
+        )
+    if keyword == "is":
+        return syntax.IsNull(column=column, negated=results[2] == "not")
+    return syntax.Comparison(
+        column=column,
+        operator=_comparison_operator(keyword),
+        value=_operand_from_results(results[2]),
+    )
+
+
+def _select_from_results(results: Any) -> syntax.SelectStatement:
+    where = results["where"][0]
+    return syntax.SelectStatement(
+        columns=tuple(results["columns"].as_list()),
+        tables=tuple(results["tables"].as_list()),
+        where=_where_from_results(where[1]) if where else None,
+    )
+
+
+def _parse_strict(text: str) -> syntax.Statement:
+    results = SIMPLE_SQL.parse_string(text, parse_all=True)
     match results.get_name():
         case "select_statement":
-            return syntax.SelectStatement(
-                columns=results["columns"].as_list(), tables=results["tables"].as_list()
-            )
+            return _select_from_results(results)
         case "insert_statement":
             return syntax.InsertStatement(table=results["table name"])
         case _:  # pragma: nocover # should never happen because pyparsing should error
             raise RuntimeError
+
+
+# hand-written lexer and recursive descent parser for the same grammar,
+# which avoids building pyparsing's ParseResults for every statement
+
+type TokenKind = Literal[
+    "KEYWORD", "IDENTIFIER", "NUMBER", "STRING", "OPERATOR", "PUNCTUATION", "END"
+]
+
+
+class Token(NamedTuple):
+    kind: TokenKind
+    value: str
+    loc: int
+
+
+_TOKEN_RE = re.compile(
+    r"""
+    (?P<SKIP>[ \t\r\n]+|--[^\n]*)
+    |(?P<KEYWORD>
+        (?i:select|from|where|and|or|in|is|not|null|insert|into|values)
+        (?![A-Za-z0-9_$])
+    )
+    |(?P<IDENTIFIER>[A-Za-z][A-Za-z0-9_$]*(?:\.[A-Za-z][A-Za-z0-9_$]*)*)
+    |(?P<NUMBER>[+-]?(?:\d+\.\d*|\.\d+|\d+))
+    # same escapes as pyparsing.quoted_string: \x must be followed by hex digits
+    |(?P<STRING>
+        '(?:[^'\n\r\\]|''|\\(?:[^x]|x[0-9a-fA-F]+))*'
+        |"(?:[^"\n\r\\]|""|\\(?:[^x]|x[0-9a-fA-F]+))*"
+    )
+    |(?P<OPERATOR>!=|<=|>=|=|<|>)
+    |(?P<PUNCTUATION>[(),*])
+    """,
+    re.VERBOSE,
+)
+
+
+def tokenize(text: str) -> list[Token]:
+    tokens: list[Token] = []
+    loc = 0
+    while loc < len(text):
+        match = _TOKEN_RE.match(text, loc)
+        if match is None:
+            raise pyparsing.ParseException(text, loc, "Unexpected character")
+        kind = match.lastgroup
+        if kind != "SKIP":
+            value = match.group()
+            if kind in ("KEYWORD", "IDENTIFIER"):
+                value = value.upper()
+            tokens.append(Token(cast(TokenKind, kind), value, loc))
+        loc = match.end()
+    tokens.append(Token("END", "", loc))
+    return tokens
+
+
+class _Parser:
+    def __init__(self, tokens: Sequence[Token], text: str) -> None:
+        self._text = text
+        self._tokens = tokens
+        self._pos = 0
+
+    def _error(self, expected: str) -> pyparsing.ParseException:
+        token = self._tokens[self._pos]
+        if not self._text:
+            # without the source, pyparsing cannot tell what was found instead
+            expected = f"{expected}, found {token.value or 'end of text'!r}"
+        return pyparsing.ParseException(self._text, token.loc, f"Expected {expected}")
+
+    def _peek(self, kind: TokenKind, value: str | None = None) -> bool:
+        token = self._tokens[self._pos]
+        return token.kind == kind and (value is None or token.value == value)
+
+    def _accept(self, kind: TokenKind, value: str | None = None) -> Token | None:
+        if not self._peek(kind, value):
+            return None
+        token = self._tokens[self._pos]
+        self._pos += 1
+        return token
+
+    def _expect(self, kind: TokenKind, value: str | None = None) -> Token:
+        if (token := self._accept(kind, value)) is None:
+            raise self._error(value or kind.lower())
+        return token
+
+    def parse(self) -> syntax.Statement:
+        if self._peek("KEYWORD", "SELECT"):
+            statement: syntax.Statement = self._select()
+        elif self._peek("KEYWORD", "INSERT"):
+            statement = self._insert()
+        else:
+            raise self._error("SELECT or INSERT")
+        self._expect("END")
+        return statement
+
+    def _select(self) -> syntax.SelectStatement:
+        self._expect("KEYWORD", "SELECT")
+        if self._accept("PUNCTUATION", "*"):
+            columns: tuple[str, ...] = ("*",)
+        else:
+            columns = self._identifier_list()
+        self._expect("KEYWORD", "FROM")
+        tables = self._identifier_list()
+        where = self._or_expression() if self._accept("KEYWORD", "WHERE") else None
+        return syntax.SelectStatement(columns=columns, tables=tables, where=where)
+
+    def _insert(self) -> syntax.InsertStatement:
+        self._expect("KEYWORD", "INSERT")
+        self._expect("KEYWORD", "INTO")
+        table = self._expect("IDENTIFIER").value
+        self._expect("KEYWORD", "VALUES")
+        return syntax.InsertStatement(table=table)
+
+    def _identifier_list(self) -> tuple[str, ...]:
+        identifiers = [self._expect("IDENTIFIER").value]
+        while self._accept("PUNCTUATION", ","):
+            identifiers.append(self._expect("IDENTIFIER").value)
+        return tuple(identifiers)
+
+    def _or_expression(self) -> syntax.Expression:
+        operands = [self._and_expression()]
+        while self._accept("KEYWORD", "OR"):
+            operands.append(self._and_expression())
+        return (
+            operands[0] if len(operands) == 1 else syntax.Or(operands=tuple(operands))
+        )
+
+    def _and_expression(self) -> syntax.Expression:
+        operands = [self._not_expression()]
+        while self._accept("KEYWORD", "AND"):
+            operands.append(self._not_expression())
+        return (
+            operands[0] if len(operands) == 1 else syntax.And(operands=tuple(operands))
+        )
+
+    def _not_expression(self) -> syntax.Expression:
+        if self._accept("KEYWORD", "NOT"):
+            return syntax.Not(operand=self._not_expression())
+        if self._accept("PUNCTUATION", "("):
+            expression = self._or_expression()
+            self._expect("PUNCTUATION", ")")
+            return expression
+        return self._condition()
+
+    def _condition(self) -> syntax.Expression:
+        column = self._expect("IDENTIFIER").value
+        if self._accept("KEYWORD", "IN"):
+            self._expect("PUNCTUATION", "(")
+            if self._peek("KEYWORD", "SELECT"):
+                expression: syntax.Expression = syntax.InSelect(
+                    column=column, select=self._select()
+                )
+            else:
+                values = [self._operand()]
+                while self._accept("PUNCTUATION", ","):
+                    values.append(self._operand())
+                expression = syntax.InValues(column=column, values=tuple(values))
+            self._expect("PUNCTUATION", ")")
+            return expression
+        if self._accept("KEYWORD", "IS"):
+            negated = self._accept("KEYWORD", "NOT") is not None
+            self._expect("KEYWORD", "NULL")
+            return syntax.IsNull(column=column, negated=negated)
+        operator = self._accept("OPERATOR") or self._accept_word_operator()
+        if operator is None:
+            raise self._error("comparison operator, IN or IS")
+        return syntax.Comparison(
+            column=column,
+            operator=_comparison_operator(operator.value),
+            value=self._operand(),
+        )
+
+    def _accept_word_operator(self) -> Token | None:
+        token = self._tokens[self._pos]
+        if token.kind == "IDENTIFIER" and token.value in _WORD_OPERATORS:
+            self._pos += 1
+            return token
+        return None
+
+    def _operand(self) -> syntax.Operand:
+        if token := self._accept("NUMBER"):
+            return float(token.value) if "." in token.value else int(token.value)
+        if token := self._accept("STRING"):
+            return _unquote(token.value)
+        if token := self._accept("IDENTIFIER"):
+            return syntax.ColumnReference(name=token.value)
+        raise self._error("value or column name")
+
+
+# text is only used to report errors, tokens carry their own location
+def parse_tokens(tokens: Sequence[Token], *, text: str = "") -> syntax.Statement:
+    return _Parser(tokens, text).parse()
+
+
+# both parsers raise pyparsing.ParseException on invalid input. Statements are
+# immutable, so repeated queries share the cached result
+@functools.lru_cache(maxsize=1024)
+def parse(text: str, *, strict: bool = False) -> syntax.Statement:
+    if strict:
+        return _parse_strict(text)
+    return parse_tokens(tokenize(text), text=text)
+
+
+# a statement is lexed once when prepared, and its syntax tree is only built
+# (or rebuilt, after a reset) from the stored tokens when it is needed
+@dataclasses.dataclass(slots=True, kw_only=True)
+class PreparedStatement:
+    text: str
+    tokens: tuple[Token, ...]
+    ast: syntax.Statement | None = None
+
+    @property
+    def statement(self) -> syntax.Statement:
+        if self.ast is None:
+            self.ast = parse_tokens(self.tokens, text=self.text)
+        return self.ast
+
+    def reset(self) -> None:
+        self.ast = None
+
+
+def prepare(text: str) -> PreparedStatement:
+    return PreparedStatement(text=text, tokens=tuple(tokenize(text)))
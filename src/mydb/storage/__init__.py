@@ -1,12 +1,20 @@
+import collections
+import dataclasses
+import hashlib
+import json
 import logging
+import mmap
+import operator
+import os
 import pathlib
-import urllib.parse
-from collections.abc import Iterator, Mapping, Sequence
-from io import IOBase
-from typing import Any, Literal, Self
+import struct
+from collections.abc import Buffer, Callable, Mapping, Sequence
+from typing import Any, Literal, NoReturn, Self
 
+import numpy
 import polars
-import pydantic
+
+from mydb import compiler, syntax
 
 logger = logging.getLogger(__name__)
 
@@ -19,61 +27,154 @@ class ColumnDoesNotExist(MyDBError):
     pass
 
 
+class IncompatibleTypes(MyDBError):
+    pass
+
+
 type DataTypes = Literal["STRING", "INTEGER"]
 
 _DATATYPE_LENGHTS: dict[DataTypes, int] = {"STRING": 16, "INTEGER": 8}
 ALL_DATATYPES: Sequence[DataTypes] = tuple(_DATATYPE_LENGHTS.keys())
 DATATYPE_TO_TYPE: dict[DataTypes, type[Any]] = {"STRING": str, "INTEGER": int}
+_DATATYPE_TO_NUMPY_DTYPE: dict[DataTypes, str] = {"STRING": "S16", "INTEGER": "<i8"}
+_DATATYPE_TO_OPERAND_TYPES: dict[DataTypes, tuple[type[Any], ...]] = {
+    "STRING": (str,),
+    "INTEGER": (int, float),
+}
 MAX_TABLE_NAME_LENGTH = 255
+_HEADER_FILE_NAME = "header.json"
+_MMAP_MIN_SIZE = 64 * 1024
 
 
-class ColumnInfo(pydantic.BaseModel):
-    model_config = pydantic.ConfigDict(frozen=True)
+@dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
+class ColumnInfo:
     name: str
     datatype: DataTypes
 
+    def __post_init__(self) -> None:
+        if "\n" in self.name or "\r" in self.name:
+            raise ValueError(f"Column name cannot contain line breaks: {self.name!r}")
+        if self.datatype not in ALL_DATATYPES:
+            raise ValueError(f"Unknown datatype {self.datatype!r}")
 
-class TableInfo(pydantic.BaseModel):
-    model_config = pydantic.ConfigDict(frozen=True)
-    columns: list[ColumnInfo]
 
-    # TODO Cache these properties, probably using a materialized view
-    @property
-    def column_offsets(self) -> dict[str, int]:
-        offset = 0
-        offsets: dict[str, int] = {}
-        for col in self.columns:
-            offsets[col.name] = offset
-            offset += _DATATYPE_LENGHTS[col.datatype]
-        return offsets
+@dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
+class TableInfo:
+    columns: tuple[ColumnInfo, ...]
+    columns_dict: dict[str, ColumnInfo] = dataclasses.field(
+        init=False, repr=False, compare=False
+    )
 
-    @property
-    def columns_dict(self) -> dict[str, ColumnInfo]:
-        return {col.name: col for col in self.columns}
+    def __post_init__(self) -> None:
+        object.__setattr__(
+            self, "columns_dict", {col.name: col for col in self.columns}
+        )
+
+
+def _serialize_header(name: str, table_info: TableInfo) -> bytes:
+    as_string = json.dumps(
+        {
+            "name": name,
+            "columns": [
+                {"name": col.name, "datatype": col.datatype}
+                for col in table_info.columns
+            ],
+        },
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    # json escapes line breaks inside strings, so the header is always one line
+    return as_string.encode("utf-8") + b"\n"
 
-    @property
-    def row_length(self) -> int:
-        return sum(_DATATYPE_LENGHTS[col.datatype] for col in self.columns)
+
+def _deserialize_header(serialized_header: bytes) -> tuple[str, TableInfo]:
+    assert serialized_header.endswith(b"\n")
+    header = json.loads(serialized_header[:-1])
+    return header["name"], TableInfo(
+        columns=tuple(ColumnInfo(**col) for col in header["columns"])
+    )
 
 
-def _serialize_header(table_info: TableInfo) -> bytes:
-    as_string = table_info.model_dump_json(indent=None)
-    if "\n" in as_string:
-        raise RuntimeError("Found newline character in header")
-    return as_string.encode("utf-8") + b"\n"
+def _table_directory_name(name: str) -> str:
+    # table names are stored in the header, so the directory name only has to be
+    # a unique and valid file name
+    return hashlib.blake2b(name.encode("utf-8"), digest_size=16).hexdigest()
 
 
-def _deserialize_header(serialized_header: bytes) -> tuple[TableInfo, int]:
-    assert serialized_header.endswith(b"\n")
-    return TableInfo.model_validate_json(serialized_header[:-1]), len(serialized_header)
+def _row_values_getter(
+    table_info: TableInfo,
+) -> Callable[[Mapping[str, Any]], tuple[Any, ...]]:
+    # specialized to the table columns once, so that transposing inserted rows
+    # into columns is a C level itemgetter call per row
+    getter = operator.itemgetter(*(col.name for col in table_info.columns))
+    if len(table_info.columns) == 1:
+        return lambda row: (getter(row),)
+    return getter
+
+
+def _raise_invalid_columns(
+    table_info: TableInfo, rows: Sequence[Mapping[str, Any]]
+) -> NoReturn:
+    table_columns = table_info.columns_dict.keys()
+    for row in rows:
+        if extra_columns := row.keys() - table_columns:
+            raise ColumnDoesNotExist(",".join(extra_columns))
+        if missing_columns := table_columns - row.keys():
+            raise NotImplementedError(
+                f"Missing columns: {missing_columns}. Default values is not implemented yet"
+            )
+    raise AssertionError  # pragma: nocover # callers only get here with invalid rows
+
 
+def _column_file_name(index: int) -> str:
+    return f"{index}.col"
 
+
+# A table is a directory holding the header and one file per column, where each
+# column file holds the fixed width values back to back. Queries therefore only
+# read the columns they project.
 class Table:
     def __init__(self, location: pathlib.Path) -> None:
         self._location = location
-        self.name = urllib.parse.unquote_plus(self._location.name)
-        with location.open("rb") as file:
-            self.info, self._data_start = _deserialize_header(file.readline(None))
+        self.name, self.info = _deserialize_header(
+            (location / _HEADER_FILE_NAME).read_bytes()
+        )
+        self._get_row_values = _row_values_getter(self.info)
+        # descriptors stay open for the lifetime of the table, so that inserts and
+        # queries do not resolve and open the column files on every call. Columns
+        # are read through read-only descriptors, so read-only tables can be
+        # queried, and the appending ones are only opened by the first insert
+        self._column_fds: dict[str, int] = {}
+        self._append_fds: dict[str, int] = {}
+        for i, col in enumerate(self.info.columns):
+            # column files are named by position, column names may not be valid file names
+            self._column_fds[col.name] = os.open(
+                location / _column_file_name(i), os.O_RDONLY
+            )
+
+    def _open_append_fds(self) -> dict[str, int]:
+        if not self._append_fds:
+            for i, col in enumerate(self.info.columns):
+                self._append_fds[col.name] = os.open(
+                    self._location / _column_file_name(i), os.O_WRONLY | os.O_APPEND
+                )
+        return self._append_fds
+
+    def close(self) -> None:
+        for fd in (*self._column_fds.values(), *self._append_fds.values()):
+            os.close(fd)
+        self._column_fds.clear()
+        self._append_fds.clear()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        if hasattr(self, "_column_fds"):
+            self.close()
 
     @classmethod
     def create(cls, name: str, location: pathlib.Path, info: TableInfo) -> Self:
@@ -81,104 +182,165 @@ class Table:
             raise ValueError(
                 f"Table name is too long: {len(name)} > {MAX_TABLE_NAME_LENGTH}"
             )
-        table_location = location / urllib.parse.quote_plus(name)
+        table_location = location / _table_directory_name(name)
         if table_location.exists():
             raise FileExistsError()
 
-        table_location.write_bytes(_serialize_header(info))
+        table_location.mkdir()
+        for i in range(len(info.columns)):
+            (table_location / _column_file_name(i)).touch()
+        (table_location / _HEADER_FILE_NAME).write_bytes(_serialize_header(name, info))
 
         return cls(location=table_location)
 
     def insert(self, *inserted: tuple[str, Any]) -> None:
-        inserted_column_names = {name for name, _ in inserted}
-        table_columns = {col.name for col in self.info.columns}
-        if extra_columns := inserted_column_names - table_columns:
-            raise ColumnDoesNotExist(",".join(extra_columns))
-        if missing_columns := table_columns - inserted_column_names:
-            raise NotImplementedError(
-                f"Missing columns: {missing_columns}. Default values is not implemented yet"
-            )
-        with self._location.open("ab") as fd:
-            serialized = _serialize_row(
-                self.info, {name: value for name, value in inserted}
+        row = dict(inserted)
+        if len(row) != len(inserted):
+            counts = collections.Counter(name for name, _ in inserted)
+            duplicated = [name for name, count in counts.items() if count > 1]
+            raise ValueError(f"Duplicated columns: {','.join(duplicated)}")
+        self.insert_many([row])
+
+    def insert_many(self, rows: Sequence[Mapping[str, Any]]) -> None:
+        n_columns = len(self.info.columns)
+        try:
+            row_values = list(map(self._get_row_values, rows))
+        except KeyError:
+            _raise_invalid_columns(self.info, rows)
+        if any(len(row) != n_columns for row in rows):
+            _raise_invalid_columns(self.info, rows)
+        # serialize every column before writing any, so invalid rows write nothing
+        serialized = [
+            (col.name, _serialize_column(col.datatype, values))
+            for col, values in zip(
+                self.info.columns,
+                list(zip(*row_values, strict=True)) or [()] * n_columns,
+                strict=True,
             )
-            fd.write(serialized)
+        ]
+        append_fds = self._open_append_fds()
+        for name, data in serialized:
+            _write_all(append_fds[name], data)
 
     @property
     def length(self) -> int:
-        total_data = self._location.stat().st_size - self._data_start
-        return total_data // self.info.row_length
-
-    def query(self, columns: Sequence[str]) -> polars.DataFrame:
-        table_columns = {col.name for col in self.info.columns}
-        if extra_columns := set(columns) - table_columns:
+        # columns are appended one after the other, so a row only counts once every
+        # column holds it. Inserts in progress, or torn by a failure, are not visible
+        return min(
+            os.fstat(self._column_fds[col.name]).st_size
+            // _DATATYPE_LENGHTS[col.datatype]
+            for col in self.info.columns
+        )
+
+    def query(
+        self, columns: Sequence[str], where: syntax.Expression | None = None
+    ) -> polars.DataFrame:
+        queried_columns = dict.fromkeys(columns)
+        read_columns = queried_columns | dict.fromkeys(
+            compiler.columns_in(where) if where is not None else ()
+        )
+        if extra_columns := read_columns.keys() - self.info.columns_dict.keys():
             raise ColumnDoesNotExist(",".join(extra_columns))
-        rows: list[dict[str, Any]] = []
-        with self._location.open("rb") as file:
-            file.seek(self._data_start)
-            for row_num in range(self.length):
-                rows.append(
-                    dict(  # pyright: ignore[reportCallIssue,reportArgumentType]
-                        zip(
-                            columns,
-                            _deserialize_row(
-                                self.info,
-                                file,
-                                self._data_start + row_num * self.info.row_length,
-                                columns,
-                            ),
-                            strict=True,
-                        )
-                    )
-                )
-        assert len(rows) == self.length
-        return polars.DataFrame(rows)
+        if where is not None:
+            _check_where_types(self.info, where)
+        # every column is read up to the same length, taken once, so rows appended
+        # by a concurrent insert are ignored rather than read from some columns only
+        length = self.length
+        arrays: dict[str, numpy.ndarray[Any, Any]] = {}
+        for col in read_columns:
+            datatype = self.info.columns_dict[col].datatype
+            data = _read_file(
+                self._column_fds[col], length * _DATATYPE_LENGHTS[datatype]
+            )
+            arrays[col] = _deserialize_column(datatype, data, length)
+        if where is None:
+            return polars.DataFrame({col: arrays[col] for col in queried_columns})
+        mask = compiler.compile_where(where)(arrays, length)
+        return polars.DataFrame({col: arrays[col][mask] for col in queried_columns})
+
+
+def _check_where_types(info: TableInfo, where: syntax.Expression) -> None:
+    for column, operand in compiler.comparisons(where):
+        datatype = info.columns_dict[column].datatype
+        if isinstance(operand, syntax.ColumnReference):
+            compatible = info.columns_dict[operand.name].datatype == datatype
+        else:
+            compatible = isinstance(operand, _DATATYPE_TO_OPERAND_TYPES[datatype])
+        if not compatible:
+            raise IncompatibleTypes(
+                f"Cannot compare {datatype} column {column} with {operand!r}"
+            )
 
 
-def left_pad(value: bytes, length: int) -> bytes:
-    return b"\x00" * (length - len(value)) + value
+def _write_all(fd: int, data: bytes) -> None:
+    # a single write may be partial, e.g. above 2 GiB on Linux
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view) :]
 
 
-def _serialize_value(datatype: DataTypes, value: Any) -> bytes:
-    match (datatype, value):
-        case ("STRING", str(value)):
-            as_bytes = left_pad(value.encode("utf-8"), _DATATYPE_LENGHTS["STRING"])
-        case ("INTEGER", int(value)):
-            as_bytes = value.to_bytes(_DATATYPE_LENGHTS["INTEGER"], "big", signed=True)
-        case _:
-            raise ValueError(f"Cannot serialize {value!r} as {datatype}")
-    assert len(as_bytes) == _DATATYPE_LENGHTS[datatype]
-    return as_bytes
+def _read_file(fd: int, size: int) -> Buffer:
+    # setting up a mapping costs more than copying small files with a single pread
+    if size < _MMAP_MIN_SIZE:
+        return os.pread(fd, size, 0)
+    # the mapping is released once the arrays created from it are garbage collected
+    return mmap.mmap(fd, size, access=mmap.ACCESS_READ)
 
 
-def _deserialize_value(datatype: DataTypes, fd: IOBase) -> Any:
-    value_as_bytes = fd.read(_DATATYPE_LENGHTS[datatype])
-    if datatype == "STRING":
-        return value_as_bytes.lstrip(b"\x00").decode("utf-8")
-    if datatype == "INTEGER":
-        return int.from_bytes(value_as_bytes, "big", signed=True)
-    raise ValueError(f"Unknown datatype {datatype}")
+def _serialize_strings(values: Sequence[Any]) -> bytes:
+    try:
+        encoded = [value.encode("utf-8") for value in values]
+    except AttributeError:
+        invalid = next(value for value in values if not isinstance(value, str))
+        raise ValueError(f"Cannot serialize {invalid!r} as STRING") from None
+    max_length = _DATATYPE_LENGHTS["STRING"]
+    if max(map(len, encoded), default=0) > max_length:
+        invalid = next(
+            value
+            for value, as_bytes in zip(values, encoded, strict=True)
+            if len(as_bytes) > max_length
+        )
+        raise ValueError(f"Cannot serialize {invalid!r} as STRING")
+    # struct pads "s" values with trailing nulls, which numpy drops when reading
+    return struct.pack(f"{max_length}s" * len(encoded), *encoded)
 
 
-def _serialize_row(table_info: TableInfo, values: Mapping[str, Any]) -> bytes:
-    serialized = b"".join(
-        _serialize_value(col.datatype, values[col.name]) for col in table_info.columns
-    )
-    assert len(serialized) == table_info.row_length
-    return serialized
+def _serialize_integers(values: Sequence[Any]) -> bytes:
+    try:
+        return struct.pack(f"<{len(values)}q", *values)
+    except struct.error as e:
+        raise ValueError(f"Cannot serialize values as INTEGER: {e}") from e
 
 
-def _deserialize_row(
-    table_info: TableInfo,
-    file_data: IOBase,
-    row_start: int,
-    columns: Sequence[str],
-) -> Iterator[Any]:
-    file_data.seek(row_start)
-
-    offsets = table_info.column_offsets
-    as_dict = table_info.columns_dict
-
-    for col in columns:
-        file_data.seek(row_start + offsets[col])
-        yield _deserialize_value(as_dict[col].datatype, file_data)
+def _decode_strings(values: numpy.ndarray[Any, Any]) -> numpy.ndarray[Any, Any]:
+    return numpy.strings.decode(values, "utf-8")
+
+
+def _decode_integers(values: numpy.ndarray[Any, Any]) -> numpy.ndarray[Any, Any]:
+    return values.astype(numpy.int64, copy=False)
+
+
+# datatypes are validated by ColumnInfo, so dispatching is a plain dict lookup
+_COLUMN_SERIALIZERS: dict[DataTypes, Callable[[Sequence[Any]], bytes]] = {
+    "STRING": _serialize_strings,
+    "INTEGER": _serialize_integers,
+}
+_COLUMN_DECODERS: dict[
+    DataTypes, Callable[[numpy.ndarray[Any, Any]], numpy.ndarray[Any, Any]]
+] = {
+    "STRING": _decode_strings,
+    "INTEGER": _decode_integers,
+}
+
+
+def _serialize_column(datatype: DataTypes, values: Sequence[Any]) -> bytes:
+    return _COLUMN_SERIALIZERS[datatype](values)
+
+
+def _deserialize_column(
+    datatype: DataTypes, data: Buffer, count: int
+) -> numpy.ndarray[Any, Any]:
+    values = numpy.frombuffer(
+        data, dtype=_DATATYPE_TO_NUMPY_DTYPE[datatype], count=count
+    )
+    return _COLUMN_DECODERS[datatype](values)
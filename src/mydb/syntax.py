@@ -1,11 +1,66 @@
+from __future__ import annotations
+
 import dataclasses
-from typing import TypeAlias
+from typing import Literal, TypeAlias
+
+
+@dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
+class ColumnReference:
+    name: str
+
+
+Operand: TypeAlias = ColumnReference | int | float | str
+ComparisonOperator: TypeAlias = Literal["=", "!=", "<", "<=", ">", ">="]
+
+
+@dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
+class Comparison:
+    column: str
+    operator: ComparisonOperator
+    value: Operand
+
+
+@dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
+class InValues:
+    column: str
+    values: tuple[Operand, ...]
+
+
+@dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
+class InSelect:
+    column: str
+    select: SelectStatement
+
+
+@dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
+class IsNull:
+    column: str
+    negated: bool = False
+
+
+@dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
+class Not:
+    operand: Expression
+
+
+@dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
+class And:
+    operands: tuple[Expression, ...]
+
+
+@dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
+class Or:
+    operands: tuple[Expression, ...]
+
+
+Expression: TypeAlias = Comparison | InValues | InSelect | IsNull | Not | And | Or
 
 
 @dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
 class SelectStatement:
-    columns: list[str]
-    tables: list[str]
+    columns: tuple[str, ...]
+    tables: tuple[str, ...]
+    where: Expression | None = None
 
 
 @dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
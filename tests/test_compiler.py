@@ -0,0 +1,72 @@
+import numpy
+import pytest
+
+from mydb import compiler, parser, syntax
+
+COLUMNS = {
+    "NAME": numpy.array(["Spam", "Eggs", "Ham", "Bacon"]),
+    "AGE": numpy.array([18, 42, 7, 42]),
+    "LIMIT": numpy.array([20, 40, 5, 50]),
+}
+
+
+def _where(condition: str) -> syntax.Expression:
+    statement = parser.parse(f"SELECT * FROM foo WHERE {condition}")
+    assert isinstance(statement, syntax.SelectStatement)
+    assert statement.where is not None
+    return statement.where
+
+
+@pytest.mark.parametrize(
+    ("condition", "expected"),
+    [
+        ("age = 42", [False, True, False, True]),
+        ("age ge 18", [True, True, False, True]),
+        ("name != 'Spam'", [False, True, True, True]),
+        ("age > limit", [False, True, True, False]),
+        ("name in ('Ham', 'Eggs')", [False, True, True, False]),
+        ("age < 20 and not name = 'Ham'", [True, False, False, False]),
+        ("age = 7 or name = 'Bacon' and age = 42", [False, False, True, True]),
+        ("(age = 7 or name = 'Bacon') and age = 42", [False, False, False, True]),
+        ("name is null", [False, False, False, False]),
+        ("name is not null", [True, True, True, True]),
+        (f"age < {'9' * 400}.0", [True, True, True, True]),
+    ],
+)
+def test_compile_where(condition: str, expected: list[bool]) -> None:
+    predicate = compiler.compile_where(_where(condition))
+    assert predicate(COLUMNS, len(expected)).tolist() == expected
+
+
+def test_compile_where_empty_in() -> None:
+    predicate = compiler.compile_where(syntax.InValues(column="AGE", values=()))
+    assert predicate(COLUMNS, 4).tolist() == [False, False, False, False]
+
+
+def test_compile_where_is_cached() -> None:
+    assert compiler.compile_where(_where("age = 1")) is compiler.compile_where(
+        _where("age = 1")
+    )
+
+
+def test_compile_where_subquery() -> None:
+    with pytest.raises(NotImplementedError):
+        compiler.compile_where(_where("age in (select age from bar)"))
+
+
+def test_columns_in() -> None:
+    assert compiler.columns_in(
+        _where("not (age > limit or name in ('Ham', other)) and id is null")
+    ) == {"AGE", "LIMIT", "NAME", "OTHER", "ID"}
+
+
+def test_comparisons() -> None:
+    assert list(
+        compiler.comparisons(
+            _where("not (age > limit or name in ('Ham', 1)) and id is null")
+        )
+    ) == [
+        ("AGE", syntax.ColumnReference(name="LIMIT")),
+        ("NAME", "Ham"),
+        ("NAME", 1),
+    ]
@@ -1,3 +1,6 @@
+import pyparsing
+import pytest
+
 from mydb import parser, syntax
 
 
@@ -49,9 +52,123 @@ def test_parser() -> None:
 
 def test_parse_function_simple_select() -> None:
     assert parser.parse("SELECT * FROM foo") == syntax.SelectStatement(
-        columns=["*"], tables=["FOO"]
+        columns=("*",), tables=("FOO",)
+    )
+
+
+def test_parse_function_select_where() -> None:
+    assert parser.parse(
+        "SELECT a FROM foo WHERE b = 'x' AND NOT (c > 1.5 OR d IS NOT NULL)"
+    ) == syntax.SelectStatement(
+        columns=("A",),
+        tables=("FOO",),
+        where=syntax.And(
+            operands=(
+                syntax.Comparison(column="B", operator="=", value="x"),
+                syntax.Not(
+                    operand=syntax.Or(
+                        operands=(
+                            syntax.Comparison(column="C", operator=">", value=1.5),
+                            syntax.IsNull(column="D", negated=True),
+                        )
+                    )
+                ),
+            )
+        ),
     )
 
 
 def test_parse_function_simple_insert() -> None:
     assert parser.parse("INSERT INTO foo VALUES") == syntax.InsertStatement(table="FOO")
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "SELECT * from XYZZY, ABC",
+        "select * from SYS.XYZZY",
+        "Select A,B,C from Sys.dual",
+        "Select A, B, C from Sys.dual, Table2 -- trailing comment",
+        "Select A from Sys.dual where a in ('RED','GREEN','BLUE')",
+        "Select A from Sys.dual where a in ('RED','GREEN') and b in (10,20,30)",
+        "Select A,b from table1,table2 where table1.id eq table2.id",
+        "select a from t where not (a > 1.5 or b is not null) and c != 'x'",
+        "select a from t where a in (select b from u where b <= -3)",
+        "Insert Into foo Values",
+        "select selection, fromage from intot where ins = 1",
+        "select a\tfrom\r\n t\n",
+        'select a from t where a Ge 1 and b = \'\\x1f\\n\' and c = "it""s"',
+    ],
+)
+def test_parse_matches_strict_parse(text: str) -> None:
+    assert parser.parse(text) == parser.parse(text, strict=True)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Xelect A, B, C from Sys.dual",
+        "Select A, B, C frox Sys.dual",
+        "Select",
+        "Select * from",
+        "Select &&& frox Sys.dual",
+        "Select A from t where a in ()",
+        "Select A from t where a is not",
+        "Select A from t extra",
+        "select\xa0a from t",
+        "select a from t\u2003",
+        "Select from from t",
+        "Select a from select",
+        "Select a from t where not = 1",
+        "Select a from t where a = null",
+        "select a from t where a eqb",
+        "select a from t where a ltx",
+        "select a from t where a = '\\x'",
+    ],
+)
+def test_parse_invalid(text: str) -> None:
+    with pytest.raises(pyparsing.ParseException):
+        parser.parse(text)
+    with pytest.raises(pyparsing.ParseException):
+        parser.parse(text, strict=True)
+
+
+def test_parse_is_cached() -> None:
+    text = "SELECT a, b FROM foo WHERE a = 1"
+    assert parser.parse(text) is parser.parse(text)
+    assert parser.parse(text, strict=True) == parser.parse(text)
+
+
+def test_tokenize() -> None:
+    assert parser.tokenize("select a from t where b >= 'x'") == [
+        parser.Token("KEYWORD", "SELECT", 0),
+        parser.Token("IDENTIFIER", "A", 7),
+        parser.Token("KEYWORD", "FROM", 9),
+        parser.Token("IDENTIFIER", "T", 14),
+        parser.Token("KEYWORD", "WHERE", 16),
+        parser.Token("IDENTIFIER", "B", 22),
+        parser.Token("OPERATOR", ">=", 24),
+        parser.Token("STRING", "'x'", 27),
+        parser.Token("END", "", 30),
+    ]
+
+
+def test_parse_tokens_without_text() -> None:
+    text = "SELECT a FROM foo WHERE a in (1, 2)"
+    assert parser.parse_tokens(parser.tokenize(text)) == parser.parse(text)
+    with pytest.raises(pyparsing.ParseException, match="found 'FROM'"):
+        parser.parse_tokens(parser.tokenize("SELECT FROM foo"))
+    with pytest.raises(pyparsing.ParseException, match="found 'end of text'"):
+        parser.parse_tokens(parser.tokenize("SELECT a FROM"))
+
+
+def test_prepared_statement() -> None:
+    text = "SELECT a FROM foo WHERE b = 1"
+    prepared = parser.prepare(text)
+    assert prepared.ast is None
+    statement = prepared.statement
+    assert statement == parser.parse(text)
+    assert prepared.statement is statement
+    prepared.reset()
+    assert prepared.statement is not statement
+    assert prepared.statement == statement
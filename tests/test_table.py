@@ -1,9 +1,8 @@
 # pyright: reportPrivateUsage=false
-import io
+import os
 import pathlib
 import string
 import tempfile
-from io import BytesIO
 from typing import Any
 
 import hypothesis
@@ -11,21 +10,37 @@ import polars
 import pytest
 from hypothesis import strategies as st
 
-from mydb import storage
+from mydb import parser, storage, syntax
 
 st_n_rows = st.integers(min_value=0, max_value=20)
-MAX_INT = 2 ** (storage._DATATYPE_LENGHTS["INTEGER"] * 4 - 1) - 1
+MAX_INT = 2 ** (storage._DATATYPE_LENGHTS["INTEGER"] * 8 - 1) - 1
 
 _DATATYPE_TO_STRATEGY: dict[storage.DataTypes, st.SearchStrategy[Any]] = {
     "STRING": st.text(
         alphabet=string.printable, max_size=storage._DATATYPE_LENGHTS["STRING"]
     ),
-    "INTEGER": st.integers(min_value=-MAX_INT, max_value=MAX_INT),
+    "INTEGER": st.integers(min_value=-MAX_INT - 1, max_value=MAX_INT),
 }
 
 
 type TableInfoAndRows = tuple[storage.TableInfo, list[dict[str, Any]]]
 
+# examples that write tables skip the deadline (file system latency is noisy)
+# and are capped, since each one creates a table on disk
+roundtrip_settings = hypothesis.settings(deadline=None, max_examples=50)
+
+
+# hypothesis does not reset function scoped fixtures between examples, so
+# examples share a session directory and each one creates its own subdirectory
+# in it, which is only removed by pytest at the end of the run
+@pytest.fixture(scope="session")
+def tmp_root(tmp_path_factory: pytest.TempPathFactory) -> pathlib.Path:
+    return tmp_path_factory.mktemp("tables")
+
+
+def _example_directory(root: pathlib.Path) -> pathlib.Path:
+    return pathlib.Path(tempfile.mkdtemp(dir=root))
+
 
 @st.composite
 def st_table_info(draw: st.DrawFn) -> storage.TableInfo:
@@ -40,10 +55,10 @@ def st_table_info(draw: st.DrawFn) -> storage.TableInfo:
     )
     hypothesis.assume(len(set(col[0] for col in columns)) == len(columns))
     return storage.TableInfo(
-        columns=[
+        columns=tuple(
             storage.ColumnInfo(name=name, datatype=datatype)
             for name, datatype in columns
-        ]
+        )
     )
 
 
@@ -70,23 +85,23 @@ def _create_test_table(location: pathlib.Path) -> storage.Table:
         name="my_test_table",
         location=location,
         info=storage.TableInfo(
-            columns=[
+            columns=(
                 storage.ColumnInfo(name="name", datatype="STRING"),
                 storage.ColumnInfo(name="age", datatype="INTEGER"),
-            ]
+            )
         ),
     )
 
     return table
 
 
+@roundtrip_settings
 @hypothesis.given(n_rows=st_n_rows)
-def test_len_works(n_rows: int) -> None:
-    with tempfile.TemporaryDirectory() as tmpdir:
-        table = _create_test_table(pathlib.Path(tmpdir))
+def test_len_works(tmp_root: pathlib.Path, n_rows: int) -> None:
+    with _create_test_table(_example_directory(tmp_root)) as table:
         for i in range(n_rows):
             table.insert(("name", f"Spam{i}"), ("age", i))
-        hypothesis.note(table._location.read_bytes())
+        hypothesis.note((table._location / "0.col").read_bytes())
         assert table.length == n_rows
 
 
@@ -96,75 +111,85 @@ def test_table_insert_column_that_does_not_exist(tmp_path: pathlib.Path) -> None
         table.insert(("name", "Spam"), ("foo", 18))
 
 
+def test_table_insert_duplicated_column(tmp_path: pathlib.Path) -> None:
+    table = _create_test_table(tmp_path)
+    with pytest.raises(ValueError, match="Duplicated columns: name"):
+        table.insert(("name", "Spam"), ("age", 18), ("name", "Eggs"))
+    assert table.length == 0
+
+
+def test_table_insert_many_missing_column(tmp_path: pathlib.Path) -> None:
+    table = _create_test_table(tmp_path)
+    with pytest.raises(NotImplementedError, match="age"):
+        table.insert_many([{"name": "Spam", "age": 18}, {"name": "Eggs"}])
+    assert table.length == 0
+
+
+@pytest.mark.parametrize(
+    "name", [".", "..", "a/b", "é" * storage.MAX_TABLE_NAME_LENGTH]
+)
+def test_table_create_name_is_not_a_file_name(
+    tmp_path: pathlib.Path, name: str
+) -> None:
+    info = storage.TableInfo(columns=(storage.ColumnInfo(name="a", datatype="STRING"),))
+    table = storage.Table.create(name=name, location=tmp_path, info=info)
+    assert storage.Table(table._location).name == name
+    with pytest.raises(FileExistsError):
+        storage.Table.create(name=name, location=tmp_path, info=info)
+
+
+@roundtrip_settings
 @hypothesis.given(table_info=st_table_info())
 def test_table_roundtrip_table_creation_and_get_info(
-    table_info: storage.TableInfo,
+    tmp_root: pathlib.Path, table_info: storage.TableInfo
 ) -> None:
-    with tempfile.TemporaryDirectory() as tmpdir:
-        table = storage.Table.create(
-            name="my_test_table", location=pathlib.Path(tmpdir), info=table_info
-        )
-    assert table_info == table.info
+    with storage.Table.create(
+        name="my_test_table", location=_example_directory(tmp_root), info=table_info
+    ) as table:
+        assert table_info == table.info
 
 
-@hypothesis.given(info=st_table_info())
+@hypothesis.given(name=st.text(), info=st_table_info())
 def test_table_roundtrip_serialize_deserialize_header(
-    info: storage.TableInfo,
+    name: str, info: storage.TableInfo
 ) -> None:
-    info, _ = storage._deserialize_header(storage._serialize_header(info))
-    assert info == info
+    serialized = storage._serialize_header(name, info)
+    assert (name, info) == storage._deserialize_header(serialized)
 
 
-@hypothesis.given(value=_DATATYPE_TO_STRATEGY["INTEGER"])
-def test_roundtrip_serialize_deserialize_integer(value: int) -> None:
-    assert value == storage._deserialize_value(
-        "INTEGER", io.BytesIO(storage._serialize_value("INTEGER", value))
-    )
+@hypothesis.given(values=st.lists(_DATATYPE_TO_STRATEGY["INTEGER"]))
+def test_roundtrip_serialize_deserialize_integer_column(values: list[int]) -> None:
+    serialized = storage._serialize_column("INTEGER", values)
+    deserialized = storage._deserialize_column("INTEGER", serialized, len(values))
+    assert values == deserialized.tolist()
 
 
-@hypothesis.given(value=_DATATYPE_TO_STRATEGY["STRING"])
-def test_roundtrip_serialize_deserialize_string(value: str) -> None:
-    assert value == storage._deserialize_value(
-        "STRING", io.BytesIO(storage._serialize_value("STRING", value))
-    )
-
-
-@hypothesis.given(table_info_and_rows=st_table_info_and_rows())
-def test_table_roundtrip_serialize_deserialize_row(
-    table_info_and_rows: TableInfoAndRows,
-) -> None:
-    table_info, rows = table_info_and_rows
-    query_columns = [col.name for col in table_info.columns]
-    hypothesis.assume(len(rows) >= 0)
-    for row in rows:
-        expected = [row[col] for col in query_columns]
-        assert expected == list(
-            storage._deserialize_row(
-                table_info,
-                BytesIO(storage._serialize_row(table_info, row)),
-                row_start=0,
-                columns=query_columns,
-            )
-        )
+@hypothesis.given(values=st.lists(_DATATYPE_TO_STRATEGY["STRING"]))
+def test_roundtrip_serialize_deserialize_string_column(values: list[str]) -> None:
+    serialized = storage._serialize_column("STRING", values)
+    deserialized = storage._deserialize_column("STRING", serialized, len(values))
+    assert values == deserialized.tolist()
 
 
+@roundtrip_settings
 @hypothesis.given(
     table_info_and_rows=st_table_info_and_rows(),
     name=st.text(min_size=1, max_size=storage.MAX_TABLE_NAME_LENGTH),
     data=st.data(),
 )
 def test_roundtrip_insert_query_no_filter(
-    table_info_and_rows: TableInfoAndRows, name: str, data: st.DataObject
+    tmp_root: pathlib.Path,
+    table_info_and_rows: TableInfoAndRows,
+    name: str,
+    data: st.DataObject,
 ) -> None:
-    with tempfile.TemporaryDirectory() as tmpdir:
-        table_info, rows = table_info_and_rows
-        table = storage.Table.create(
-            name=name, location=pathlib.Path(tmpdir), info=table_info
-        )
+    table_info, rows = table_info_and_rows
+    with storage.Table.create(
+        name=name, location=_example_directory(tmp_root), info=table_info
+    ) as table:
         hypothesis.note(f"{table._location.stem=}")
         assert table.name == name
-        for row in rows:
-            table.insert(*((k, v) for k, v in row.items()))
+        table.insert_many(rows)
         query_columns = data.draw(
             st.lists(
                 st.sampled_from([col.name for col in table_info.columns]),
@@ -178,3 +203,165 @@ def test_roundtrip_insert_query_no_filter(
         assert as_df.to_dicts() == [
             {col: row[col] for col in query_columns} for row in rows
         ]
+
+
+@roundtrip_settings
+@hypothesis.given(table_info_and_rows=st_table_info_and_rows())
+def test_roundtrip_insert_many_query(
+    tmp_root: pathlib.Path, table_info_and_rows: TableInfoAndRows
+) -> None:
+    table_info, rows = table_info_and_rows
+    with storage.Table.create(
+        name="my_test_table", location=_example_directory(tmp_root), info=table_info
+    ) as table:
+        table.insert_many(rows)
+        assert table.length == len(rows)
+        as_df = table.query([col.name for col in table_info.columns])
+        assert as_df.to_dicts() == rows
+
+
+@pytest.mark.parametrize(
+    "row",
+    [
+        {"name": "x" * (storage._DATATYPE_LENGHTS["STRING"] + 1), "age": 18},
+        {"name": b"Spam", "age": 18},
+        {"name": "Spam", "age": "18"},
+        {"name": "Spam", "age": 2**64},
+    ],
+)
+def test_table_insert_many_invalid_value(
+    tmp_path: pathlib.Path, row: dict[str, Any]
+) -> None:
+    table = _create_test_table(tmp_path)
+    with pytest.raises(ValueError, match="Cannot serialize"):
+        table.insert_many([{"name": "Eggs", "age": 1}, row])
+    assert table.length == 0
+
+
+def test_column_info_unknown_datatype() -> None:
+    with pytest.raises(ValueError, match="FLOAT"):
+        storage.ColumnInfo(name="price", datatype="FLOAT")  # type: ignore[arg-type]
+
+
+@pytest.mark.parametrize("name", ["first\nname", "first\rname"])
+def test_column_info_name_with_line_break(name: str) -> None:
+    with pytest.raises(ValueError, match="line breaks"):
+        storage.ColumnInfo(name=name, datatype="STRING")
+
+
+def test_table_query_where(tmp_path: pathlib.Path) -> None:
+    table = storage.Table.create(
+        name="my_test_table",
+        location=tmp_path,
+        info=storage.TableInfo(
+            columns=(
+                storage.ColumnInfo(name="NAME", datatype="STRING"),
+                storage.ColumnInfo(name="AGE", datatype="INTEGER"),
+            )
+        ),
+    )
+    table.insert_many(
+        [
+            {"NAME": "Spam", "AGE": 18},
+            {"NAME": "Eggs", "AGE": 42},
+            {"NAME": "Ham", "AGE": 7},
+        ]
+    )
+    statement = parser.parse("SELECT name FROM my_test_table WHERE age >= 18")
+    assert isinstance(statement, syntax.SelectStatement)
+    as_df = table.query(["NAME"], where=statement.where)
+    assert as_df.to_dicts() == [{"NAME": "Spam"}, {"NAME": "Eggs"}]
+
+
+def test_table_query_where_column_that_does_not_exist(tmp_path: pathlib.Path) -> None:
+    table = _create_test_table(tmp_path)
+    where = syntax.Comparison(column="foo", operator="=", value=1)
+    with pytest.raises(storage.ColumnDoesNotExist, match="foo"):
+        table.query(["name"], where=where)
+
+
+@pytest.mark.parametrize(
+    "where",
+    [
+        syntax.Comparison(column="age", operator=">", value="x"),
+        syntax.Comparison(column="name", operator="=", value=1),
+        syntax.Comparison(
+            column="name", operator="=", value=syntax.ColumnReference(name="age")
+        ),
+        syntax.Not(operand=syntax.InValues(column="age", values=(1, "x"))),
+    ],
+)
+def test_table_query_where_incompatible_types(
+    tmp_path: pathlib.Path, where: syntax.Expression
+) -> None:
+    table = _create_test_table(tmp_path)
+    with pytest.raises(storage.IncompatibleTypes, match="Cannot compare"):
+        table.query(["name"], where=where)
+
+
+def test_table_query_where_empty_in(tmp_path: pathlib.Path) -> None:
+    with _create_test_table(tmp_path) as table:
+        table.insert_many([{"name": "Spam", "age": 18}, {"name": "Eggs", "age": 42}])
+        where = syntax.InValues(column="age", values=())
+        assert table.query(["name"], where=where).to_dicts() == []
+
+
+def test_table_query_where_float_literal(tmp_path: pathlib.Path) -> None:
+    with _create_test_table(tmp_path) as table:
+        table.insert_many([{"name": "Spam", "age": 18}, {"name": "Eggs", "age": 42}])
+        for value, expected in ((20.5, ["Spam"]), (float("inf"), ["Spam", "Eggs"])):
+            where = syntax.Comparison(column="age", operator="<", value=value)
+            assert table.query(["name"], where=where)["name"].to_list() == expected
+
+
+def test_table_query_large_columns(tmp_path: pathlib.Path) -> None:
+    n_rows = storage._MMAP_MIN_SIZE // storage._DATATYPE_LENGHTS["INTEGER"] + 1
+    rows = [{"name": f"Spam{i}", "age": i} for i in range(n_rows)]
+    with _create_test_table(tmp_path) as table:
+        table.insert_many(rows)
+        assert table.query(["name", "age"]).to_dicts() == rows
+
+
+# the larger table has columns above _MMAP_MIN_SIZE, so that they are mapped
+@pytest.mark.parametrize(
+    "n_rows", [2, storage._MMAP_MIN_SIZE // storage._DATATYPE_LENGHTS["INTEGER"] + 1]
+)
+def test_table_query_partially_written_row(tmp_path: pathlib.Path, n_rows: int) -> None:
+    rows = [{"name": f"Spam{i}", "age": i} for i in range(n_rows)]
+    with _create_test_table(tmp_path) as table:
+        table.insert_many(rows)
+        # a torn insert that only reached the first column
+        with open(table._location / "0.col", "ab") as column:
+            column.write(storage._serialize_column("STRING", ["Ham"]))
+        assert table.length == len(rows)
+        assert table.query(["name", "age"]).to_dicts() == rows
+
+
+def test_table_close(tmp_path: pathlib.Path) -> None:
+    with _create_test_table(tmp_path) as table:
+        table.insert(("name", "Spam"), ("age", 18))
+    table.close()
+    assert storage.Table(table._location).length == 1
+
+
+@pytest.mark.skipif(os.geteuid() == 0, reason="root ignores file permissions")
+def test_table_query_read_only(tmp_path: pathlib.Path) -> None:
+    with _create_test_table(tmp_path) as table:
+        table.insert(("name", "Spam"), ("age", 18))
+    for path in table._location.iterdir():
+        path.chmod(0o444)
+    with storage.Table(table._location) as table:
+        assert table.query(["name", "age"]).to_dicts() == [{"name": "Spam", "age": 18}]
+        with pytest.raises(PermissionError):
+            table.insert(("name", "Eggs"), ("age", 42))
+
+
+def test_table_insert_many_partial_writes(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    write = os.write
+    monkeypatch.setattr(os, "write", lambda fd, data: write(fd, data[:3]))
+    rows = [{"name": f"Spam{i}", "age": i} for i in range(10)]
+    with _create_test_table(tmp_path) as table:
+        table.insert_many(rows)
+        assert table.query(["name", "age"]).to_dicts() == rows